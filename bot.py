@@ -10,14 +10,17 @@ Features:
 - Admin command /admin to view overall statistics
 """
 
+import asyncio
 import logging
 import sqlite3
+import aiosqlite
 from decimal import Decimal, ROUND_DOWN
-from datetime import datetime, date
+from datetime import date
 import os
 from dotenv import load_dotenv
 
 from aiogram import Bot, Dispatcher, types, executor
+from aiogram.dispatcher.filters import Text
 
 # ---- load config ----
 load_dotenv()
@@ -38,6 +41,14 @@ DB_PATH = "refbot.db"
 def init_db():
     conn = sqlite3.connect(DB_PATH)
     cur = conn.cursor()
+    # WAL survives reopen, so setting it once here covers the bot's shared
+    # connection too; NORMAL sync + busy_timeout keep writes cheap under WAL.
+    cur.execute("PRAGMA journal_mode=WAL;")
+    cur.execute("PRAGMA synchronous=NORMAL;")
+    cur.execute("PRAGMA temp_store=MEMORY;")
+    cur.execute("PRAGMA cache_size=-64000;")
+    cur.execute("PRAGMA busy_timeout=5000;")
+    cur.execute("PRAGMA mmap_size=268435456;")
     cur.execute("""
     CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -45,16 +56,30 @@ def init_db():
         username TEXT,
         first_name TEXT,
         referred_by INTEGER,
-        joined_at TEXT
+        joined_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+        ref_count INTEGER NOT NULL DEFAULT 0,
+        balance INTEGER NOT NULL DEFAULT 0
     )
     """)
+    try:
+        cur.execute("ALTER TABLE users ADD COLUMN ref_count INTEGER NOT NULL DEFAULT 0")
+        cur.execute("UPDATE users SET ref_count = (SELECT COUNT(*) FROM users r WHERE r.referred_by = users.telegram_id)")
+    except sqlite3.OperationalError:
+        pass  # column already present (fresh DB or already migrated)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_users_ref_count AFTER INSERT ON users
+    WHEN NEW.referred_by IS NOT NULL
+    BEGIN
+        UPDATE users SET ref_count = ref_count + 1 WHERE telegram_id = NEW.referred_by;
+    END
+    """)
     cur.execute("""
     CREATE TABLE IF NOT EXISTS deposits (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         user_telegram_id INTEGER,
-        amount TEXT,
+        amount INTEGER,
         currency TEXT,
-        created_at TEXT
+        created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now'))
     )
     """)
     cur.execute("""
@@ -62,8 +87,8 @@ def init_db():
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         referrer_telegram_id INTEGER,
         from_user_telegram_id INTEGER,
-        amount TEXT,
-        created_at TEXT,
+        amount INTEGER,
+        created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
         note TEXT
     )
     """)
@@ -71,91 +96,190 @@ def init_db():
     CREATE TABLE IF NOT EXISTS withdrawals (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         user_telegram_id INTEGER,
-        amount TEXT,
+        amount INTEGER,
         status TEXT,
-        created_at TEXT
+        created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now'))
     )
     """)
+    # one-time migration: legacy rows hold dollar strings ("100.00"), new code
+    # writes integer cents. Dollar strings always contain a dot, cent values
+    # never do, so the predicate also keeps the rewrite idempotent.
+    if cur.execute("PRAGMA user_version").fetchone()[0] < 1:
+        for table in ("deposits", "ref_earnings", "withdrawals"):
+            cur.execute(f"UPDATE {table} SET amount = CAST(ROUND(CAST(amount AS REAL) * 100) AS INTEGER) "
+                        "WHERE instr(amount, '.') > 0")
+        cur.execute("PRAGMA user_version = 1")
+    # the timestamp DEFAULTs above only apply to freshly created tables;
+    # legacy tables keep their old column definitions, so fill the value via
+    # trigger there and repair any NULLs rows written before these existed
+    for table, column in (("users", "joined_at"), ("deposits", "created_at"),
+                          ("ref_earnings", "created_at"), ("withdrawals", "created_at")):
+        cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_{column} AFTER INSERT ON {table}
+        WHEN NEW.{column} IS NULL
+        BEGIN
+            UPDATE {table} SET {column} = strftime('%Y-%m-%dT%H:%M:%fZ','now') WHERE id = NEW.id;
+        END
+        """)
+        cur.execute(f"UPDATE {table} SET {column} = strftime('%Y-%m-%dT%H:%M:%fZ','now') WHERE {column} IS NULL")
+    try:
+        cur.execute("ALTER TABLE users ADD COLUMN balance INTEGER NOT NULL DEFAULT 0")
+        cur.execute("""
+        UPDATE users SET balance =
+            COALESCE((SELECT SUM(amount) FROM ref_earnings WHERE referrer_telegram_id = users.telegram_id), 0)
+          - COALESCE((SELECT SUM(amount) FROM withdrawals WHERE user_telegram_id = users.telegram_id AND status = 'paid'), 0)
+        """)
+    except sqlite3.OperationalError:
+        pass  # column already present (fresh DB or already migrated)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_ref_earn_balance AFTER INSERT ON ref_earnings
+    BEGIN
+        UPDATE users SET balance = balance + NEW.amount WHERE telegram_id = NEW.referrer_telegram_id;
+    END
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_withdrawal_paid AFTER UPDATE OF status ON withdrawals
+    WHEN NEW.status = 'paid' AND OLD.status != 'paid'
+    BEGIN
+        UPDATE users SET balance = balance - NEW.amount WHERE telegram_id = NEW.user_telegram_id;
+    END
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_users_referred_by ON users(referred_by)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ref_earn_ref ON ref_earnings(referrer_telegram_id, created_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_withdrawals_user_status ON withdrawals(user_telegram_id, status)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_deposits_user ON deposits(user_telegram_id)")
     conn.commit()
     conn.close()
 
-init_db()
-
 # ---- helpers ----
-def db_conn():
-    return sqlite3.connect(DB_PATH)
-
-def decimal_str(v):
-    d = Decimal(v).quantize(Decimal("0.01"), rounding=ROUND_DOWN)
-    return format(d, 'f')
-
-def get_bot_username_sync():
-    import asyncio
-    loop = asyncio.get_event_loop()
-    me = loop.run_until_complete(bot.get_me())
-    return me.username
-
-BOT_USERNAME = get_bot_username_sync() or "YourBotUsername"
-
-def create_user_if_not_exists(tg_id:int, username:str=None, first_name:str=None, referred_by:int=None):
-    conn = db_conn(); cur = conn.cursor()
-    cur.execute("SELECT telegram_id FROM users WHERE telegram_id = ?", (tg_id,))
-    if cur.fetchone() is None:
-        cur.execute(
-            "INSERT INTO users (telegram_id, username, first_name, referred_by, joined_at) VALUES (?, ?, ?, ?, ?)",
-            (tg_id, username, first_name, referred_by, datetime.utcnow().isoformat())
+DB = None  # single shared aiosqlite connection, created lazily
+
+# serialises writes on the shared connection: with isolation_level=None an
+# explicit BEGIN..COMMIT spans awaits, and an unlocked write from another
+# coroutine would interleave into (and die or roll back with) that transaction
+_write_lock = asyncio.Lock()
+
+# hot-path queries as module constants: the same string object reaches
+# sqlite3's statement cache every time, so statements are only compiled once
+SQL_COUNT_REFERRED = "SELECT ref_count FROM users WHERE telegram_id = ?"
+SQL_BALANCE = "SELECT balance FROM users WHERE telegram_id = ?"
+SQL_SUM_REF_TOTAL_TODAY = (
+    "SELECT COALESCE(SUM(amount), 0), "
+    "COALESCE(SUM(CASE WHEN created_at >= ? THEN amount END), 0) "
+    "FROM ref_earnings WHERE referrer_telegram_id = ?"
+)
+SQL_MY_REFS = (
+    "SELECT COALESCE(username, first_name, CAST(telegram_id AS TEXT)) "
+    "|| ' (' || telegram_id || ') — ' || substr(COALESCE(joined_at, ''), 1, 10) "
+    "FROM users WHERE referred_by = ? ORDER BY joined_at DESC LIMIT 100"
+)
+
+async def get_db():
+    global DB
+    if DB is None:
+        # isolation_level=None: no driver-managed implicit transactions —
+        # single statements autocommit, multi-write paths BEGIN explicitly
+        DB = await aiosqlite.connect(DB_PATH, isolation_level=None)
+    return DB
+
+def to_cents(v):
+    """Convert a Decimal/str amount to integer cents, rounding down."""
+    return int((Decimal(v) * 100).quantize(Decimal("1"), rounding=ROUND_DOWN))
+
+def decimal_str(cents:int):
+    """Format integer cents as a human-readable amount string."""
+    cents = int(cents)  # tolerate REAL/text cents from unmigrated rows
+    sign = "-" if cents < 0 else ""
+    cents = abs(cents)
+    return f"{sign}{cents // 100}.{cents % 100:02d}"
+
+BOT_USERNAME = "YourBotUsername"  # real value filled in by on_startup
+
+async def create_user_if_not_exists(tg_id:int, username:str=None, first_name:str=None, referred_by:int=None):
+    db = await get_db()
+    async with _write_lock:
+        if referred_by is not None:
+            await db.execute("INSERT OR IGNORE INTO users (telegram_id) VALUES (?)", (referred_by,))
+        await db.execute(
+            "INSERT OR IGNORE INTO users (telegram_id, username, first_name, referred_by) VALUES (?, ?, ?, ?)",
+            (tg_id, username, first_name, referred_by)
         )
-        conn.commit()
-    conn.close()
 
-def get_user(tg_id):
-    conn = db_conn(); cur = conn.cursor()
-    cur.execute("SELECT telegram_id, username, first_name, referred_by, joined_at FROM users WHERE telegram_id = ?", (tg_id,))
-    row = cur.fetchone()
-    conn.close()
-    if not row:
-        return None
-    return {
-        "telegram_id": row[0],
-        "username": row[1],
-        "first_name": row[2],
-        "referred_by": row[3],
-        "joined_at": row[4]
-    }
-
-def count_referred(tg_id):
-    conn = db_conn(); cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM users WHERE referred_by = ?", (tg_id,))
-    r = cur.fetchone()[0]
-    conn.close()
-    return r
+async def upsert_user(tg_id:int, username:str=None, first_name:str=None, referred_by:int=None):
+    """Register the user or refresh username/first_name in one round trip.
+
+    referred_by and joined_at are only set on first insert; the UPDATE is
+    skipped entirely when nothing changed.
+    """
+    db = await get_db()
+    async with _write_lock:
+        if referred_by is not None:
+            # the referrer may not have started the bot yet; the ref_count
+            # trigger needs their row to exist to credit the signup
+            await db.execute("INSERT OR IGNORE INTO users (telegram_id) VALUES (?)", (referred_by,))
+        await db.execute(
+            "INSERT INTO users (telegram_id, username, first_name, referred_by) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(telegram_id) DO UPDATE SET username = excluded.username, first_name = excluded.first_name "
+            "WHERE users.username IS NOT excluded.username OR users.first_name IS NOT excluded.first_name",
+            (tg_id, username, first_name, referred_by)
+        )
 
-def sum_ref_earnings(tg_id):
-    conn = db_conn(); cur = conn.cursor()
-    cur.execute("SELECT COALESCE(SUM(CAST(amount AS REAL)), 0) FROM ref_earnings WHERE referrer_telegram_id = ?", (tg_id,))
-    s = Decimal(str(cur.fetchone()[0] or "0"))
-    conn.close()
-    return s
+async def count_referred(tg_id):
+    db = await get_db()
+    async with db.execute(SQL_COUNT_REFERRED, (tg_id,)) as cur:
+        row = await cur.fetchone()
+    return row[0] if row else 0
 
-def sum_ref_earnings_today(tg_id):
-    conn = db_conn(); cur = conn.cursor()
+async def sum_ref_earnings_total_and_today(tg_id):
+    db = await get_db()
     today_iso = date.today().isoformat()
-    cur.execute("SELECT amount, created_at FROM ref_earnings WHERE referrer_telegram_id = ?", (tg_id,))
-    rows = cur.fetchall()
-    total = Decimal("0")
-    for amount, created_at in rows:
-        if created_at and created_at.startswith(today_iso):
-            total += Decimal(str(amount))
-    conn.close()
-    return total
-
-def pending_withdrawable(tg_id):
-    total = sum_ref_earnings(tg_id)
-    conn = db_conn(); cur = conn.cursor()
-    cur.execute("SELECT COALESCE(SUM(CAST(amount AS REAL)), 0) FROM withdrawals WHERE user_telegram_id = ? AND status = 'paid'", (tg_id,))
-    paid = Decimal(str(cur.fetchone()[0] or "0"))
-    conn.close()
-    return total - paid
+    async with db.execute(SQL_SUM_REF_TOTAL_TODAY, (today_iso, tg_id)) as cur:
+        total, today = await cur.fetchone()
+    return total, today
+
+async def pending_withdrawable(tg_id):
+    db = await get_db()
+    async with db.execute(SQL_BALANCE, (tg_id,)) as cur:
+        row = await cur.fetchone()
+    return row[0] if row else 0
+
+async def add_deposits_batch(rows):
+    """Ingest deposits in bulk: one referrer lookup, one transaction.
+
+    rows is a list of (user_telegram_id, amount_cents, currency). Returns the
+    credited bonuses as (referrer_id, from_user_id, bonus_cents) tuples so the
+    caller can notify referrers.
+    """
+    if not rows:
+        return []
+    db = await get_db()
+    ids = list({uid for uid, _, _ in rows})
+    placeholders = ",".join("?" * len(ids))
+    async with db.execute(f"SELECT telegram_id, referred_by FROM users WHERE telegram_id IN ({placeholders})", ids) as cur:
+        referred_by = dict(await cur.fetchall())
+    bonuses = []
+    for uid, amount, _ in rows:
+        ref = referred_by.get(uid)
+        if ref and ref != uid:
+            bonus = int((amount * REF_PERCENT / Decimal("100")).quantize(Decimal("1"), rounding=ROUND_DOWN))
+            bonuses.append((ref, uid, bonus))
+    # one transaction for all writes: single fsync, atomic deposits+bonuses
+    async with _write_lock:
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            await db.executemany("INSERT INTO deposits (user_telegram_id, amount, currency) VALUES (?,?,?)", rows)
+            if bonuses:
+                # a referrer may never have started the bot; the balance
+                # trigger needs their users row to exist to credit them
+                await db.executemany("INSERT OR IGNORE INTO users (telegram_id) VALUES (?)",
+                                     [(ref,) for ref in {ref for ref, _, _ in bonuses}])
+                await db.executemany("INSERT INTO ref_earnings (referrer_telegram_id, from_user_telegram_id, amount, note) VALUES (?,?,?,?)",
+                                     [(ref, uid, bonus, f"Referral bonus {REF_PERCENT}% from {uid}") for ref, uid, bonus in bonuses])
+            await db.execute("COMMIT")
+        except Exception:
+            await db.execute("ROLLBACK")
+            raise
+    return bonuses
 
 # ---- keyboards ----
 def welcome_keyboard():
@@ -182,15 +306,9 @@ async def cmd_start(message: types.Message):
         except:
             referred_by = None
 
-    existing = get_user(message.from_user.id)
-    if existing is None:
-        if referred_by == message.from_user.id:
-            referred_by = None
-        create_user_if_not_exists(message.from_user.id, message.from_user.username, message.from_user.first_name, referred_by)
-    else:
-        conn = db_conn(); cur = conn.cursor()
-        cur.execute("UPDATE users SET username = ?, first_name = ? WHERE telegram_id = ?", (message.from_user.username, message.from_user.first_name, message.from_user.id))
-        conn.commit(); conn.close()
+    if referred_by == message.from_user.id:
+        referred_by = None
+    await upsert_user(message.from_user.id, message.from_user.username, message.from_user.first_name, referred_by)
 
     await message.answer(
         "💰 Привет!\n"
@@ -204,34 +322,29 @@ async def cmd_start(message: types.Message):
         reply_markup=welcome_keyboard()
     )
 
-@dp.message_handler(lambda message: message.text == "📊 Моя статистика")
+@dp.message_handler(Text(equals="📊 Моя статистика"))
 async def show_stats_menu(message: types.Message):
     await message.answer("Выбери действие:", reply_markup=stats_keyboard())
 
-@dp.message_handler(lambda message: message.text == "◀️ Назад")
+@dp.message_handler(Text(equals="◀️ Назад"))
 async def go_back(message: types.Message):
     await message.answer("Главное меню", reply_markup=welcome_keyboard())
 
-@dp.message_handler(lambda message: message.text == "👥 Мои рефералы")
+@dp.message_handler(Text(equals="👥 Мои рефералы"))
 async def my_refs(message: types.Message):
-    conn = db_conn(); cur = conn.cursor()
-    cur.execute("SELECT telegram_id, username, first_name, joined_at FROM users WHERE referred_by = ? ORDER BY joined_at DESC", (message.from_user.id,))
-    rows = cur.fetchall(); conn.close()
+    db = await get_db()
+    # format in SQL and stream rows; LIMIT keeps us under Telegram's 4096-char cap
+    async with db.execute(SQL_MY_REFS, (message.from_user.id,)) as cur:
+        rows = await cur.fetchall()
     if not rows:
         await message.answer("У тебя ещё нет рефералов.", reply_markup=stats_keyboard())
         return
-    lines = []
-    for r in rows:
-        tid, uname, fname, joined = r
-        display = uname or fname or str(tid)
-        lines.append(f"- {display} ({tid}) — {joined.split('T')[0]}")
-    await message.answer("Твои рефералы:\n" + "\n".join(lines), reply_markup=stats_keyboard())
-
-@dp.message_handler(lambda message: message.text == "💰 Мой доход")
+    await message.answer("Твои рефералы:\n" + "\n".join("- " + row[0] for row in rows), reply_markup=stats_keyboard())
+
+@dp.message_handler(Text(equals="💰 Мой доход"))
 async def my_income(message: types.Message):
-    total = sum_ref_earnings(message.from_user.id)
-    today = sum_ref_earnings_today(message.from_user.id)
-    to_withdraw = pending_withdrawable(message.from_user.id)
+    total, today = await sum_ref_earnings_total_and_today(message.from_user.id)
+    to_withdraw = await pending_withdrawable(message.from_user.id)
     await message.answer(
         f"💰 Мой доход\n\n"
         f"Всего заработано: {decimal_str(total)} USDT\n"
@@ -240,22 +353,23 @@ async def my_income(message: types.Message):
         reply_markup=stats_keyboard()
     )
 
-@dp.message_handler(lambda message: message.text == "🏧 Вывести реферальные")
+@dp.message_handler(Text(equals="🏧 Вывести реферальные"))
 async def withdraw_request(message: types.Message):
-    to_withdraw = pending_withdrawable(message.from_user.id)
-    if to_withdraw <= Decimal("0"):
+    to_withdraw = await pending_withdrawable(message.from_user.id)
+    if to_withdraw <= 0:
         await message.answer("У тебя нет средств для вывода.", reply_markup=stats_keyboard())
         return
-    conn = db_conn(); cur = conn.cursor()
-    cur.execute("INSERT INTO withdrawals (user_telegram_id, amount, status, created_at) VALUES (?, ?, ?, ?)",
-                (message.from_user.id, decimal_str(to_withdraw), "pending", datetime.utcnow().isoformat()))
-    conn.commit(); conn.close()
-    await message.answer(f"Заявка на вывод создана: {decimal_str(to_withdraw)} USDT\nСтатус: ожидает обработки.", reply_markup=stats_keyboard())
-    for admin in ADMINS:
-        try:
-            await bot.send_message(admin, f"📤 Новая заявка на вывод:\nПользователь: @{message.from_user.username or message.from_user.id} ({message.from_user.id})\nСумма: {decimal_str(to_withdraw)} USDT")
-        except Exception:
-            logging.exception("cannot notify admin")
+    db = await get_db()
+    async with _write_lock:
+        await db.execute("INSERT INTO withdrawals (user_telegram_id, amount, status) VALUES (?, ?, ?)",
+                         (message.from_user.id, to_withdraw, "pending"))
+    amount_str = decimal_str(to_withdraw)
+    await message.answer(f"Заявка на вывод создана: {amount_str} USDT\nСтатус: ожидает обработки.", reply_markup=stats_keyboard())
+    admin_text = f"📤 Новая заявка на вывод:\nПользователь: @{message.from_user.username or message.from_user.id} ({message.from_user.id})\nСумма: {amount_str} USDT"
+    results = await asyncio.gather(*(bot.send_message(admin, admin_text) for admin in ADMINS), return_exceptions=True)
+    for admin, result in zip(ADMINS, results):
+        if isinstance(result, Exception):
+            logging.error("cannot notify admin %s: %s", admin, result)
 
 # ---- admin commands ----
 @dp.message_handler(commands=["add_deposit"])
@@ -267,49 +381,58 @@ async def admin_add_deposit(message: types.Message):
         await message.reply("Использование: /add_deposit <user_id> <amount> [currency]"); return
     try:
         target_id = int(args[0])
-        amount = Decimal(args[1])
+        amount = to_cents(args[1])
     except Exception:
         await message.reply("Неверные параметры."); return
     currency = args[2] if len(args) >= 3 else "USDT"
-    create_user_if_not_exists(target_id)
-    conn = db_conn(); cur = conn.cursor()
-    cur.execute("INSERT INTO deposits (user_telegram_id, amount, currency, created_at) VALUES (?,?,?,?)",
-                (target_id, decimal_str(amount), currency, datetime.utcnow().isoformat()))
-    conn.commit()
-    user = get_user(target_id)
-    if user and user.get("referred_by"):
-        referrer = user["referred_by"]
-        if referrer != target_id:
-            bonus = (amount * REF_PERCENT / Decimal("100")).quantize(Decimal("0.01"), rounding=ROUND_DOWN)
-            cur.execute("INSERT INTO ref_earnings (referrer_telegram_id, from_user_telegram_id, amount, created_at, note) VALUES (?,?,?,?,?)",
-                        (referrer, target_id, str(bonus), datetime.utcnow().isoformat(), f"Referral bonus {REF_PERCENT}% from {target_id}"))
-            conn.commit()
-            try:
-                await bot.send_message(referrer, f"🎉 Твой реферал @{user.get('username') or user.get('first_name') or target_id} пополнил {decimal_str(amount)} {currency}. Тебе начислено {decimal_str(bonus)} USDT.")
-            except Exception:
-                pass
-    conn.close()
+    await create_user_if_not_exists(target_id)
+    bonuses = await add_deposits_batch([(target_id, amount, currency)])
+    if bonuses:
+        referrer, _, bonus = bonuses[0]
+        db = await get_db()
+        async with db.execute("SELECT username, first_name FROM users WHERE telegram_id = ?", (target_id,)) as cur:
+            uname, fname = await cur.fetchone() or (None, None)
+        amount_str = decimal_str(amount)
+        bonus_str = decimal_str(bonus)
+        try:
+            await bot.send_message(referrer, f"🎉 Твой реферал @{uname or fname or target_id} пополнил {amount_str} {currency}. Тебе начислено {bonus_str} USDT.")
+        except Exception:
+            pass
     await message.reply("✅ Депозит добавлен и реферальный бонус начислен при необходимости.")
 
+@dp.message_handler(commands=["mark_paid"])
+async def admin_mark_paid(message: types.Message):
+    if message.from_user.id not in ADMINS:
+        await message.reply("Только админы."); return
+    args = message.get_args().split()
+    if len(args) < 1:
+        await message.reply("Использование: /mark_paid <withdrawal_id>"); return
+    try:
+        wd_id = int(args[0])
+    except Exception:
+        await message.reply("Неверные параметры."); return
+    db = await get_db()
+    # the status-change trigger deducts the amount from the user's balance
+    async with _write_lock:
+        cur = await db.execute("UPDATE withdrawals SET status = 'paid' WHERE id = ? AND status = 'pending'", (wd_id,))
+    if cur.rowcount == 0:
+        await message.reply("Заявка не найдена или уже обработана."); return
+    await message.reply("✅ Заявка отмечена как выплаченная.")
+
 @dp.message_handler(commands=["admin"])
 async def admin_stats(message: types.Message):
     if message.from_user.id not in ADMINS:
         await message.reply("Только админы.")
         return
 
-    conn = db_conn(); cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM users")
-    total_users = cur.fetchone()[0]
-
-    cur.execute("SELECT COUNT(*) FROM users WHERE referred_by IS NOT NULL")
-    total_referrals = cur.fetchone()[0]
-
-    cur.execute("SELECT COALESCE(SUM(CAST(amount AS REAL)),0) FROM deposits")
-    total_deposits = Decimal(str(cur.fetchone()[0] or "0"))
-
-    cur.execute("SELECT COALESCE(SUM(CAST(amount AS REAL)),0) FROM ref_earnings")
-    total_ref_earnings = Decimal(str(cur.fetchone()[0] or "0"))
-    conn.close()
+    db = await get_db()
+    async with db.execute(
+        "SELECT (SELECT COUNT(*) FROM users), "
+        "(SELECT COUNT(*) FROM users WHERE referred_by IS NOT NULL), "
+        "(SELECT COALESCE(SUM(amount),0) FROM deposits), "
+        "(SELECT COALESCE(SUM(amount),0) FROM ref_earnings)"
+    ) as cur:
+        total_users, total_referrals, total_deposits, total_ref_earnings = await cur.fetchone()
 
     text = (
         f"📊 Статистика бота\n\n"
@@ -326,6 +449,22 @@ async def fallback(message: types.Message):
     await message.answer("Не понимаю. Используй меню.", reply_markup=welcome_keyboard())
 
 # ---- start bot ----
+async def on_startup(dp):
+    global BOT_USERNAME
+    BOT_USERNAME = (await bot.get_me()).username
+    # init_db uses the blocking sqlite3 driver; run it off the event loop.
+    # Handler I/O already stays off the loop via aiosqlite's worker thread.
+    await asyncio.to_thread(init_db)
+    db = await get_db()
+    await db.execute("PRAGMA journal_mode=WAL")
+    await db.execute("PRAGMA synchronous=normal")
+    await db.execute("PRAGMA temp_store=memory")
+    await db.execute("PRAGMA cache_size=-64000")
+
+async def on_shutdown(dp):
+    if DB is not None:
+        await DB.close()
+
 if __name__ == "__main__":
     print("Bot is starting...")
-    executor.start_polling(dp, skip_updates=True)
+    executor.start_polling(dp, skip_updates=True, on_startup=on_startup, on_shutdown=on_shutdown)